@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
+import argparse
+import atexit
+import json
 import os
+import stat
 import subprocess
 import sys
-import re # For regular expressions to check http:// prefix
+import threading
+import shlex
+import re # For validating domain names and proxy URLs
 import platform # To detect OS for clear screen command
 
 # --- Configuration ---
@@ -11,49 +17,290 @@ NGINX_SITES_AVAILABLE = "/etc/nginx/sites-available"
 NGINX_SITES_ENABLED = "/etc/nginx/sites-enabled"
 NGINX_LOG_DIR = "/var/log/nginx" 
 
+# A domain name: dot-separated labels of letters, digits, '-' and '_', not starting or ending with '-'
+HOSTNAME_RE = re.compile(r'^[A-Za-z0-9_](?:[A-Za-z0-9_-]*[A-Za-z0-9_])?(?:\.[A-Za-z0-9_](?:[A-Za-z0-9_-]*[A-Za-z0-9_])?)*$')
+# Characters that would break out of the proxy_pass directive in the generated config
+PROXY_URL_FORBIDDEN_RE = re.compile(r'[\s;{}]')
+
+# Nginx config template with placeholders, filled in with str.format() by add_new_domain()
+CONFIG_TEMPLATE = """server {{
+    listen 80;
+    listen [::]:80;
+    server_name {server_name};
+
+    location / {{
+        proxy_pass {proxy_pass_url};
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }}
+
+    error_log {log_dir}/{server_name}_error.log;
+    access_log {log_dir}/{server_name}_access.log;
+}}
+
+# HTTPS block will be managed by Certbot later
+# server {{
+#     listen 443 ssl;
+#     listen [::]:443 ssl;
+#     server_name {server_name};
+#     
+#     location / {{
+#         proxy_pass {proxy_pass_url};
+#         proxy_set_header Host $host;
+#         proxy_set_header X-Real-IP $remote_addr;
+#         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+#         proxy_set_header X-Forwarded-Proto $scheme;
+#     }}
+# }}
+"""
+
+# Cache of sites-available listings, keyed by (directory, mtime_ns)
+_domains_cache = {}
+
 # --- Utility Functions ---
 
+# Resolved once at import; on POSIX terminals the screen is cleared with an ANSI escape
+# (clear + cursor home) instead of forking the 'clear' command
+IS_WINDOWS = platform.system() == "Windows"
+CLEAR_SEQUENCE = "\x1b[2J\x1b[H"
+
+# False when running a single subcommand from the command line: no screen clearing, no prompts
+INTERACTIVE = True
+
 def clear_screen():
     """Clears the terminal screen."""
-    if platform.system() == "Windows":
+    if not INTERACTIVE:
+        return
+    if IS_WINDOWS:
         os.system('cls')
     else:
-        os.system('clear')
+        sys.stdout.write(CLEAR_SEQUENCE)
+        sys.stdout.flush()
+
+# Is the script already running as root? Then privileged operations need no sudo at all.
+IS_ROOT = hasattr(os, 'geteuid') and os.geteuid() == 0
+
+# --- Privileged Operations ---
+# These run as root: in-process when the script itself runs as root, otherwise inside the
+# privileged helper, which is this script started under sudo with --helper.
+
+def helper_dispatch(op, args):
+    """Performs one privileged operation. Returns a dict with 'returncode', 'stdout' and 'stderr' keys."""
+    if op == 'run':
+        # args: [command, capture_stdout]; commands that are silent on stdout skip the stdout pipe entirely
+        stdout = subprocess.PIPE if len(args) < 2 or args[1] else subprocess.DEVNULL
+        try:
+            # stdin is the helper's request pipe; commands must never read from it
+            cp = subprocess.run(args[0], stdin=subprocess.DEVNULL, stdout=stdout, stderr=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            return {'returncode': 127, 'stdout': '', 'stderr': f"{args[0][0]}: command not found"}
+        return {'returncode': cp.returncode, 'stdout': cp.stdout or '', 'stderr': cp.stderr}
+    if op == 'write_file':
+        # Atomic write: a temp file in the same directory is fsynced and renamed over
+        # the target, so Nginx never sees a partially written config
+        path, content = args
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp-{os.getpid()}")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, path)
+        finally:
+            # Whatever went wrong (I/O, encoding, ...), never leave the temp file behind
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+    elif op == 'symlink':
+        os.symlink(args[0], args[1])
+    elif op == 'remove':
+        # Behaves like 'rm -f': missing paths are fine, other failures are reported after trying every path
+        errors = []
+        for path in args:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append(str(e))
+        if errors:
+            return {'returncode': 1, 'stdout': '', 'stderr': '\n'.join(errors)}
+    else:
+        return {'returncode': 2, 'stdout': '', 'stderr': f"unknown helper operation: {op}"}
+    return {'returncode': 0, 'stdout': '', 'stderr': ''}
+
+def helper_handle(op, args):
+    """Like helper_dispatch(), but never raises; errors are returned with returncode 1."""
+    try:
+        return helper_dispatch(op, args)
+    except Exception as e: # Bad arguments must not take down the long-lived helper
+        return {'returncode': 1, 'stdout': '', 'stderr': str(e)}
+
+def helper_serve():
+    """
+    Main loop of the privileged helper (nginx.py --helper). Serves one JSON request
+    per line on stdin, answering with one JSON result per line on stdout.
+    """
+    print(json.dumps('ready'), flush=True)
+    for line in sys.stdin:
+        try:
+            op, *args = json.loads(line)
+        except (ValueError, TypeError) as e:
+            result = {'returncode': 1, 'stdout': '', 'stderr': f"malformed helper request: {e}"}
+        else:
+            result = helper_handle(op, args)
+        print(json.dumps(result), flush=True)
+
+_helper = None # The running privileged helper process, started on first use
+
+def start_helper(non_interactive=False):
+    """
+    Starts the privileged helper under sudo if it is not already running.
+    With non_interactive set, sudo fails instead of prompting for a password.
+    Returns True once the helper has reported it is ready, False otherwise.
+    """
+    global _helper
+    if _helper is not None and _helper.poll() is None:
+        return True
+    try:
+        sudo = ['sudo', '-n'] if non_interactive else ['sudo']
+        # A non-interactive start may run while the user is at a prompt, so keep sudo's
+        # "a password is required" message off the terminal; failure is reported by the caller
+        stderr = subprocess.DEVNULL if non_interactive else None
+        _helper = subprocess.Popen(sudo + [sys.executable, '-u', os.path.abspath(__file__), '--helper'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, text=True)
+    except FileNotFoundError:
+        print("Error: 'sudo' command not found. Is it installed and in your PATH?")
+        _helper = None
+        return False
+    if _helper.stdout.readline().strip() != json.dumps('ready'):
+        _helper.wait()
+        _helper = None
+        return False
+    return True
+
+def stop_helper():
+    """Shuts down the privileged helper, if running."""
+    global _helper
+    if _helper is None:
+        return
+    try:
+        _helper.stdin.close()
+    except OSError:
+        pass
+    _helper.wait()
+    _helper = None
 
-def run_sudo_command(command, check=True):
+atexit.register(stop_helper)
+
+def helper_call(op, *args):
     """
-    Runs a command with sudo. Returns True on success, False on failure.
+    Sends one operation to the privileged helper and returns its result
+    as a dict with 'returncode', 'stdout' and 'stderr' keys.
     """
-    print(f"\nRunning: sudo {' '.join(command)}")
+    if IS_ROOT:
+        return helper_handle(op, list(args))
+    if not start_helper():
+        return {'returncode': 1, 'stdout': '', 'stderr': "Could not start the privileged helper (sudo failed)."}
     try:
-        # Use Popen to allow password prompt to be interactive
-        process = subprocess.Popen(['sudo'] + command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            print(f"Error executing: {' '.join(command)}")
-            if stdout: print(f"STDOUT:\n{stdout}")
-            if stderr: print(f"STDERR:\n{stderr}")
+        _helper.stdin.write(json.dumps([op, *args]) + "\n")
+        _helper.stdin.flush()
+        line = _helper.stdout.readline()
+    except OSError:
+        line = ''
+    if not line:
+        stop_helper()
+        return {'returncode': 1, 'stdout': '', 'stderr': "The privileged helper exited unexpectedly."}
+    return json.loads(line)
+
+def run_privileged(op, *args, check=True, description=None):
+    """
+    Runs a helper operation with root privileges. Returns True on success, False on failure.
+    """
+    print(f"\nRunning: {'' if IS_ROOT else 'sudo '}{description or ' '.join([op, *args])}")
+    try:
+        result = helper_call(op, *args)
+        if result['returncode'] != 0:
+            print(f"Error executing: {description or ' '.join([op, *args])}")
+            if result['stdout']: print(f"STDOUT:\n{result['stdout']}")
+            if result['stderr']: print(f"STDERR:\n{result['stderr']}")
             if check:
-                raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+                raise subprocess.CalledProcessError(result['returncode'], [op, *args], result['stdout'], result['stderr'])
             return False
-        # print(f"Output:\n{stdout}") # Uncomment for verbose output
+        # print(f"Output:\n{result['stdout']}") # Uncomment for verbose output
         return True
     except subprocess.CalledProcessError as e:
         print(f"Command failed with exit code {e.returncode}")
         print(f"Output:\n{e.stdout}")
         print(f"Error:\n{e.stderr}")
         return False
-    except FileNotFoundError:
-        print(f"Error: Command '{command[0]}' not found. Is it installed and in your PATH?")
-        return False
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return False
 
+def run_sudo_command(command, check=True, capture_stdout=True):
+    """
+    Runs a command with sudo through the privileged helper. Returns True on success, False on failure.
+    Pass capture_stdout=False for commands that print nothing on stdout; it is discarded instead of piped back.
+    """
+    return run_privileged('run', command, capture_stdout, check=check, description=shlex.join(command))
+
+def run_sudo_shell(script, check=True, capture_stdout=True):
+    """
+    Runs a shell script as root in a single process, so several related
+    commands only pay for one process startup. Returns True on success, False on failure.
+    """
+    return run_sudo_command(['sh', '-c', script], check=check, capture_stdout=capture_stdout)
+
+def pause(prompt="\nPress Enter to return to main menu..."):
+    """Waits for Enter so the user can read the output. Does nothing in non-interactive mode."""
+    if INTERACTIVE:
+        input(prompt)
+
+def choose_domain(available_domains, header, action, domain_name=None):
+    """
+    Returns the domain to act on. A domain_name given on the command line is checked against
+    available_domains; otherwise the user picks one from a numbered list.
+    Returns None if the domain is unknown or the choice is invalid.
+    """
+    if domain_name is not None:
+        if domain_name not in available_domains:
+            print(f"Error: No configuration named '{domain_name}' in {NGINX_SITES_AVAILABLE}.")
+            return None
+        return domain_name
+
+    print(header)
+    for i, domain in enumerate(available_domains):
+        print(f"  {i+1}. {domain}")
+
+    try:
+        choice = int(input(f"Enter the number of the domain to {action}: ").strip())
+    except ValueError:
+        print("Invalid input. Please enter a number.")
+        return None
+    if 1 <= choice <= len(available_domains):
+        return available_domains[choice - 1]
+    print("Invalid choice.")
+    return None
+
+def classify_path(path):
+    """
+    Classifies a path with a single lstat() call.
+    Returns 'link' for a symlink, 'file' for anything else that exists, or None if nothing is there
+    (or the path cannot be examined, like os.path.exists/islink).
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return 'link' if stat.S_ISLNK(st.st_mode) else 'file'
+
 def check_nginx_config():
     """Tests Nginx configuration syntax."""
     print("\nTesting Nginx configuration...")
-    result = run_sudo_command(['nginx', '-t'], check=False)
+    result = run_sudo_command(['nginx', '-t'], check=False, capture_stdout=False) # nginx -t reports on stderr
     if not result:
         print("Nginx configuration test failed. Please fix errors before proceeding.")
         return False
@@ -61,261 +308,266 @@ def check_nginx_config():
         print("Nginx configuration syntax is OK.")
         return True
 
-def reload_nginx():
-    """Reloads Nginx service."""
-    print("\nReloading Nginx...")
-    if run_sudo_command(['systemctl', 'reload', 'nginx']):
-        print("Nginx reloaded successfully.")
+def test_and_reload():
+    """Tests Nginx configuration syntax and, if it is OK, reloads Nginx in one privileged call."""
+    print("\nTesting Nginx configuration and reloading...")
+    # Neither command writes to stdout; nginx -t reports on stderr
+    if run_sudo_shell("nginx -t && systemctl reload nginx", check=False, capture_stdout=False):
+        print("Nginx configuration syntax is OK. Nginx reloaded successfully.")
         return True
     else:
-        print("Failed to reload Nginx. Check logs for details.")
+        print("Nginx configuration test or reload failed. Check the output above for details.")
         return False
 
 # --- Domain Management Functions ---
 
 def get_available_domains():
-    """Returns a list of all raw filenames in sites-available."""
-    if not os.path.isdir(NGINX_SITES_AVAILABLE):
+    """Returns a list of all raw filenames in sites-available, or None if the directory cannot be read."""
+    try:
+        dir_stat = os.stat(NGINX_SITES_AVAILABLE)
+    except OSError:
+        dir_stat = None
+    if dir_stat is None or not stat.S_ISDIR(dir_stat.st_mode):
         print(f"Error: Nginx sites-available directory not found: {NGINX_SITES_AVAILABLE}")
-        return []
-    
-    domains = []
-    for filename in os.listdir(NGINX_SITES_AVAILABLE):
-        if os.path.isfile(os.path.join(NGINX_SITES_AVAILABLE, filename)):
-            domains.append(filename)
-    return sorted(domains)
+        return None
+
+    # The directory mtime changes whenever a file is added or removed, so it is a cheap cache key
+    cache_key = (NGINX_SITES_AVAILABLE, dir_stat.st_mtime_ns)
+    cached = _domains_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    # scandir() reuses the d_type from the directory read, so no per-entry stat
+    try:
+        with os.scandir(NGINX_SITES_AVAILABLE) as entries:
+            # Dot-files are skipped: they are not site configs, and include leftover
+            # temp files from an interrupted write_file ('.<name>.tmp-<pid>')
+            domains = [entry.name for entry in entries
+                       if not entry.name.startswith('.') and entry.is_file(follow_symlinks=False)]
+    except OSError as e:
+        print(f"Error: Could not read Nginx sites-available directory: {e}")
+        return None
+    domains.sort()
+    _domains_cache.clear()
+    _domains_cache[cache_key] = domains
+    return list(domains)
 
 def list_domains():
-    """Lists all configured domains and indicates if they are enabled."""
+    """
+    Lists all configured domains and indicates if they are enabled.
+    Returns the list of domains, or None if sites-available cannot be read.
+    """
     clear_screen() # Clear screen before listing
     print("\n--- Listing all configured domains ---")
     available_domains = get_available_domains() # Get domains directly, don't call list_domains to avoid double clear/pause
     if not available_domains:
         print("No domain configurations found in sites-available.")
-        input("\nPress Enter to return to main menu...") # Pause for user to read
-        return [] # Return empty list if no domains
+        pause() # Pause for user to read
+        return available_domains # Empty list if no domains, None on error
     
     print("Available domains:")
-    enabled_domains = []
-    if os.path.isdir(NGINX_SITES_ENABLED):
-        for item in os.listdir(NGINX_SITES_ENABLED):
-            full_path = os.path.join(NGINX_SITES_ENABLED, item)
-            if os.path.islink(full_path):
-                link_target = os.path.realpath(full_path)
-                if link_target.startswith(NGINX_SITES_AVAILABLE):
-                    enabled_domains.append(os.path.basename(full_path))
+    # One scan of sites-enabled; DirEntry.is_symlink() uses the cached d_type, so no stat per entry
+    try:
+        with os.scandir(NGINX_SITES_ENABLED) as entries:
+            enabled_domains = {entry.name for entry in entries if entry.is_symlink()}
+    except OSError:
+        enabled_domains = set()
 
     for i, domain in enumerate(available_domains):
         status = " (Enabled)" if domain in enabled_domains else " (Disabled)"
         print(f"  {i+1}. {domain}{status}")
     print("--------------------------------------")
-    input("\nPress Enter to return to main menu...") # Pause for user to read
+    pause() # Pause for user to read
     return available_domains
 
-def add_new_domain():
-    """Adds a new domain configuration based on the provided template."""
+def add_new_domain(server_name=None, proxy_pass_url=None, overwrite=None):
+    """
+    Adds a new domain configuration based on the provided template.
+    Arguments left as None are asked for interactively.
+    """
     clear_screen() # Clear screen before prompt
     print("\n--- Adding a new domain (Reverse Proxy Template) ---")
-    server_name = input("Enter the domain name (e.g., ai.pikhof.eu): ").strip()
-    proxy_pass_url = input("Enter the internal URL where Nginx should proxy requests (e.g., localhost:3210 or 127.0.0.1:3210): ").strip()
+    if server_name is None:
+        server_name = input("Enter the domain name (e.g., ai.pikhof.eu): ")
+    if proxy_pass_url is None:
+        proxy_pass_url = input("Enter the internal URL where Nginx should proxy requests (e.g., localhost:3210 or 127.0.0.1:3210): ")
+    server_name = server_name.strip()
+    proxy_pass_url = proxy_pass_url.strip()
 
     if not server_name or not proxy_pass_url:
         print("Domain name and proxy pass URL cannot be empty. Aborting.")
-        input("\nPress Enter to return to main menu...")
+        pause()
+        return False
+
+    if not HOSTNAME_RE.match(server_name):
+        print(f"Invalid domain name '{server_name}'. Use letters, digits, '-', '_' and '.' only. Aborting.")
+        pause()
+        return False
+
+    if PROXY_URL_FORBIDDEN_RE.search(proxy_pass_url):
+        print(f"Invalid proxy pass URL '{proxy_pass_url}'. It must not contain spaces, ';', '{{' or '}}'. Aborting.")
+        pause()
         return False
 
     config_file_path = os.path.join(NGINX_SITES_AVAILABLE, server_name)
 
     if os.path.exists(config_file_path):
         print(f"Warning: Configuration file '{config_file_path}' already exists.")
-        overwrite = input("Overwrite existing configuration? (y/n): ").strip().lower()
-        if overwrite != 'y':
+        if overwrite is None:
+            overwrite = input("Overwrite existing configuration? (y/n): ").strip().lower() == 'y'
+        if not overwrite:
             print("Aborting domain creation.")
-            input("\nPress Enter to return to main menu...")
+            pause()
             return False
 
     # Prepend http:// to proxy_pass_url if it's missing (to avoid Nginx 'invalid URL prefix' error)
-    if not re.match(r'^(http|https)://', proxy_pass_url):
+    if not proxy_pass_url.startswith(('http://', 'https://')):
         proxy_pass_url = "http://" + proxy_pass_url
         print(f"Automatically adjusted proxy_pass_url to: {proxy_pass_url}")
 
-    # Nginx config template with placeholders
-    config_content = f"""server {{
-    listen 80;
-    listen [::]:80;
-    server_name {server_name};
-
-    location / {{
-        proxy_pass {proxy_pass_url};
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-    }}
-
-    error_log {NGINX_LOG_DIR}/{server_name}_error.log;
-    access_log {NGINX_LOG_DIR}/{server_name}_access.log;
-}}
-
-# HTTPS block will be managed by Certbot later
-# server {{
-#     listen 443 ssl;
-#     listen [::]:443 ssl;
-#     server_name {server_name};
-#     
-#     location / {{
-#         proxy_pass {proxy_pass_url};
-#         proxy_set_header Host $host;
-#         proxy_set_header X-Real-IP $remote_addr;
-#         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-#         proxy_set_header X-Forwarded-Proto $scheme;
-#     }}
-# }}
-"""
+    config_content = CONFIG_TEMPLATE.format(server_name=server_name, proxy_pass_url=proxy_pass_url, log_dir=NGINX_LOG_DIR)
     print(f"Creating Nginx server block configuration for {server_name} at {config_file_path}...")
     print("This requires sudo to write the file.")
-    process = subprocess.Popen(['sudo', 'tee', config_file_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout, stderr = process.communicate(input=config_content)
+    # Written by the privileged helper, so no sudo/tee processes and no echo of the content back
+    result = helper_call('write_file', config_file_path, config_content)
 
-    if process.returncode != 0:
+    if result['returncode'] != 0:
         print(f"Error writing config file: {config_file_path}")
-        print(f"STDOUT:\n{stdout}")
-        print(f"STDERR:\n{stderr}")
-        input("\nPress Enter to return to main menu...")
+        print(f"STDOUT:\n{result['stdout']}")
+        print(f"STDERR:\n{result['stderr']}")
+        pause()
         return False
-    
+
+    _domains_cache.clear()
     print(f"Configuration created: {config_file_path}")
     print("Please enable the domain and add HTTPS with Certbot separately.")
     if check_nginx_config():
-        input("\nPress Enter to return to main menu...")
+        pause()
         return True
-    input("\nPress Enter to return to main menu...")
+    pause()
     return False
 
-def enable_domain():
-    """Enables an existing domain configuration."""
+def _enable_domain_impl(domain_name):
+    """
+    Creates the sites-enabled symlink for domain_name, then tests and reloads Nginx,
+    reverting the symlink if that fails. No prompts. Returns True on success, False on failure.
+    """
+    config_file_source = os.path.join(NGINX_SITES_AVAILABLE, domain_name)
+    config_file_dest = os.path.join(NGINX_SITES_ENABLED, domain_name)
+
+    print(f"Enabling domain '{domain_name}' by creating symlink...")
+    if not run_privileged('symlink', config_file_source, config_file_dest, description=f"ln -s {config_file_source} {config_file_dest}"):
+        print(f"Failed to create symlink for {domain_name}.")
+        return False
+    _domains_cache.clear()
+
+    if test_and_reload():
+        return True
+    else: # Config test or reload failed
+        print("Nginx configuration test or reload failed after enabling site. Reverting symlink setup.")
+        run_privileged('remove', config_file_dest, check=False, description=f"rm -f {config_file_dest}") # Attempt to clean up
+        return False
+
+def enable_domain(domain_name=None):
+    """Enables an existing domain configuration. Asks which one if domain_name is not given."""
     clear_screen() # Clear screen before prompts
     print("\n--- Enabling an existing domain ---")
     available_domains = get_available_domains() # Get domains directly, don't call list_domains to avoid double clear/pause
     if not available_domains:
         print("No domains available to enable.")
-        input("\nPress Enter to return to main menu...")
+        pause()
         return False
     
-    print("Select domain to enable:")
-    for i, domain in enumerate(available_domains):
-        print(f"  {i+1}. {domain}")
-
-    try:
-        choice = int(input("Enter the number of the domain to enable: ").strip())
-        if 1 <= choice <= len(available_domains):
-            domain_name = available_domains[choice - 1]
-        else:
-            print("Invalid choice.")
-            input("\nPress Enter to return to main menu...")
-            return False
-    except ValueError:
-        print("Invalid input. Please enter a number.")
-        input("\nPress Enter to return to main menu...")
+    domain_name = choose_domain(available_domains, "Select domain to enable:", "enable", domain_name)
+    if domain_name is None:
+        pause()
         return False
 
-    config_file_source = os.path.join(NGINX_SITES_AVAILABLE, domain_name)
     config_file_dest = os.path.join(NGINX_SITES_ENABLED, domain_name)
-    
-    if os.path.exists(config_file_dest) or os.path.islink(config_file_dest):
-        print(f"Warning: Domain '{domain_name}' appears to be already enabled or exists as a link/file in sites-enabled.")
-        input("\nPress Enter to return to main menu...")
-        return False
 
-    print(f"Enabling domain '{domain_name}' by creating symlink...")
-    if not run_sudo_command(['ln', '-s', config_file_source, config_file_dest]):
-        print(f"Failed to create symlink for {domain_name}.")
-        input("\nPress Enter to return to main menu...")
+    if classify_path(config_file_dest) is not None:
+        print(f"Warning: Domain '{domain_name}' appears to be already enabled or exists as a link/file in sites-enabled.")
+        pause()
         return False
 
-    if check_nginx_config():
-        if reload_nginx():
-            input("\nPress Enter to return to main menu...")
-            return True
-        else: # Reload failed
-            input("\nPress Enter to return to main menu...")
-            return False
-    else: # Config test failed
-        print("Nginx configuration test failed after enabling site. Reverting symlink setup.")
-        run_sudo_command(['rm', config_file_dest], check=False) # Attempt to clean up
-        input("\nPress Enter to return to main menu...")
-        return False
+    ok = _enable_domain_impl(domain_name)
+    pause()
+    return ok
 
-def delete_domain():
-    """Deletes a domain configuration (file and symlink) and reloads Nginx."""
+def delete_domain(domain_name=None, assume_yes=False):
+    """
+    Deletes a domain configuration (file and symlink) and reloads Nginx.
+    Asks which one if domain_name is not given, and asks for confirmation unless assume_yes is set.
+    """
     clear_screen() # Clear screen before prompts
     print("\n--- Deleting a domain ---")
     available_domains = get_available_domains() # Get domains directly, don't call list_domains
     if not available_domains:
         print("No domains available to delete.")
-        input("\nPress Enter to return to main menu...")
+        pause()
         return False
 
-    print("Select domain to delete:")
-    for i, domain in enumerate(available_domains):
-        print(f"  {i+1}. {domain}")
-
-    try:
-        choice = int(input("Enter the number of the domain to delete: ").strip())
-        if 1 <= choice <= len(available_domains):
-            domain_name = available_domains[choice - 1]
-        else:
-            print("Invalid choice.")
-            input("\nPress Enter to return to main menu...")
-            return False
-    except ValueError:
-        print("Invalid input. Please enter a number.")
-        input("\nPress Enter to return to main menu...")
+    domain_name = choose_domain(available_domains, "Select domain to delete:", "delete", domain_name)
+    if domain_name is None:
+        pause()
         return False
 
-    confirm = input(f"Are you sure you want to delete '{domain_name}'? This will remove the config file and disable it. (y/n): ").strip().lower()
-    if confirm != 'y':
+    if not assume_yes:
+        if not INTERACTIVE:
+            print("Refusing to delete without confirmation. Pass --yes to confirm.")
+            return False
+        confirm = input(f"Are you sure you want to delete '{domain_name}'? This will remove the config file and disable it. (y/n): ").strip().lower()
+        assume_yes = confirm == 'y'
+    if not assume_yes:
         print("Deletion aborted.")
-        input("\nPress Enter to return to main menu...")
+        pause()
         return False
 
     config_file_source = os.path.join(NGINX_SITES_AVAILABLE, domain_name)
     config_file_dest = os.path.join(NGINX_SITES_ENABLED, domain_name) # Symlink target
 
-    # 1. Disable (remove symlink)
-    if os.path.islink(config_file_dest):
+    # 1. Disable (remove symlink) and 2. delete source config file, in a single sudo call
+    paths_to_remove = []
+    dest_kind = classify_path(config_file_dest)
+    if dest_kind == 'link':
         print(f"Disabling domain '{domain_name}' by removing symlink...")
-        if not run_sudo_command(['rm', config_file_dest]):
-            print(f"Warning: Failed to remove symlink for {domain_name}. You may need to remove it manually.")
-            # Continue to delete the source file anyway
-    elif os.path.exists(config_file_dest):
+        paths_to_remove.append(config_file_dest)
+    elif dest_kind == 'file':
         print(f"Warning: A file (not symlink) exists at {config_file_dest}. Not removing automatically.")
 
-    # 2. Delete source config file
-    if os.path.exists(config_file_source):
+    if classify_path(config_file_source) is not None:
         print(f"Deleting configuration file: {config_file_source}...")
-        if not run_sudo_command(['rm', config_file_source]):
-            print(f"Error: Failed to delete configuration file {config_file_source}. Aborting cleanup.")
-            input("\nPress Enter to return to main menu...")
-            return False
+        paths_to_remove.append(config_file_source)
     else:
         print(f"Configuration file {config_file_source} not found. Already deleted or never existed.")
 
-    # 3. Reload Nginx if anything was changed successfully
-    if check_nginx_config():
-        if reload_nginx():
-            input("\nPress Enter to return to main menu...")
-            return True
-        else: # Reload failed
-            input("\nPress Enter to return to main menu...")
-            return False
-    else: # Config test failed
-        print("Nginx configuration test failed after deletion. Check manually!")
-        input("\nPress Enter to return to main menu...")
+    if paths_to_remove:
+        # 'remove' keeps going past a failed path and reports it through the return code
+        if not run_privileged('remove', *paths_to_remove, description=f"rm -f {' '.join(paths_to_remove)}"):
+            # Work out which removal failed so the symlink stays a warning and the source file an error
+            if classify_path(config_file_dest) == 'link':
+                print(f"Warning: Failed to remove symlink for {domain_name}. You may need to remove it manually.")
+            if classify_path(config_file_source) is not None:
+                print(f"Error: Failed to delete configuration file {config_file_source}. Aborting cleanup.")
+                pause()
+                return False
+
+    _domains_cache.clear()
+
+    # 3. Test and reload Nginx in one privileged call
+    if test_and_reload():
+        pause()
+        return True
+    else: # Config test or reload failed
+        print("Nginx configuration test or reload failed after deletion. Check manually!")
+        pause()
         return False
 
-def add_https():
-    """Adds HTTPS using Certbot for Nginx."""
+def add_https(domain_name=None, enable=None):
+    """
+    Adds HTTPS using Certbot for Nginx. Asks which domain if domain_name is not given,
+    and whether to enable a disabled domain first if enable is None.
+    """
     clear_screen() # Clear screen before prompts
     print("\n--- Adding HTTPS (Certbot for Nginx) ---")
     print("IMPORTANT: Ensure your domain's DNS points to this server.")
@@ -324,81 +576,75 @@ def add_https():
     available_domains = get_available_domains() # Get domains directly, don't call list_domains
     if not available_domains:
         print("No domain configurations found in sites-available to secure with HTTPS.")
-        input("\nPress Enter to return to main menu...")
+        pause()
         return False
     
-    print("\nAvailable domains to secure:")
-    for i, domain in enumerate(available_domains):
-        print(f"  {i+1}. {domain}")
-    
-    try:
-        choice = int(input("Enter the number of the domain to secure with HTTPS: ").strip())
-        if 1 <= choice <= len(available_domains):
-            domain_name = available_domains[choice - 1]
-        else:
-            print("Invalid choice.")
-            input("\nPress Enter to return to main menu...")
-            return False
-    except ValueError:
-        print("Invalid input. Please enter a number.")
-        input("\nPress Enter to return to main menu...")
+    domain_name = choose_domain(available_domains, "\nAvailable domains to secure:", "secure with HTTPS", domain_name)
+    if domain_name is None:
+        pause()
         return False
 
     # Certbot expects the site to be enabled to find it.
     symlink_path = os.path.join(NGINX_SITES_ENABLED, domain_name)
-    if not os.path.islink(symlink_path):
+    if classify_path(symlink_path) != 'link':
         print(f"Warning: Domain '{domain_name}' is not currently enabled (no symlink in sites-enabled).")
         print("Certbot requires the domain to be enabled on port 80 to issue certificates.")
-        proceed = input("Do you want to enable it now before running Certbot? (y/n): ").strip().lower()
-        if proceed == 'y':
+        if enable is None:
+            enable = input("Do you want to enable it now before running Certbot? (y/n): ").strip().lower() == 'y'
+        if enable:
             # Attempt to enable it directly, and if successful, proceed with certbot
-            config_file_source = os.path.join(NGINX_SITES_AVAILABLE, domain_name)
-            if not run_sudo_command(['ln', '-s', config_file_source, symlink_path]):
+            if not _enable_domain_impl(domain_name):
                 print("Failed to enable domain for Certbot. Aborting HTTPS setup.")
-                input("\nPress Enter to return to main menu...")
-                return False
-            if not check_nginx_config() or not reload_nginx():
-                print("Failed to reload Nginx after enabling for Certbot. Aborting HTTPS setup.")
-                input("\nPress Enter to return to main menu...")
+                pause()
                 return False
             print(f"Domain '{domain_name}' enabled for Certbot.")
         else:
             print("Aborting HTTPS setup as domain is not enabled.")
-            input("\nPress Enter to return to main menu...")
+            pause()
             return False
 
     # Construct Certbot command WITHOUT www subdomain
     certbot_command_str = f"sudo certbot --nginx -d {domain_name}"
     
-    print("\n" + "="*70)
-    print("THIS SCRIPT HAS PAUSED. PLEASE EXECUTE THE FOLLOWING COMMAND MANUALLY.")
-    print("="*70)
-    print(f"  {certbot_command_str}")
-    print("\nAnswer any questions Certbot may ask (e.g., email, TOS, redirect).")
-    print("Certbot will automatically reload Nginx for you if successful.")
-    print("="*70 + "\n")
+    if not INTERACTIVE:
+        print(f"\nRun the following command to obtain the certificate:\n  {certbot_command_str}")
+        return True
+
+    separator = "=" * 70
+    print(f"\n{separator}\n"
+          "THIS SCRIPT HAS PAUSED. PLEASE EXECUTE THE FOLLOWING COMMAND MANUALLY.\n"
+          f"{separator}\n"
+          f"  {certbot_command_str}\n"
+          "\nAnswer any questions Certbot may ask (e.g., email, TOS, redirect).\n"
+          "Certbot will automatically reload Nginx for you if successful.\n"
+          f"{separator}\n")
 
     input("Press Enter AFTER you have run the Certbot command manually and it has completed successfully...")
     
-    print("\nCertbot usually handles Nginx reload automatically.")
-    print("You can verify automatic renewal: sudo systemctl status certbot.timer")
-    print("Returning to main menu.")
-    input("\nPress Enter to return to main menu...") # Pause for user to read final message
+    print("\nCertbot usually handles Nginx reload automatically.\n"
+          "You can verify automatic renewal: sudo systemctl status certbot.timer\n"
+          "Returning to main menu.")
+    pause() # Pause for user to read final message
     return True # We assume user ran it successfully
 
 # --- Main Menu ---
 
+MAIN_MENU = (
+    "\n--- Nginx Domain Management Script ---\n"
+    "  1. List all configured domains\n"
+    "  2. Add a new domain (Reverse Proxy)\n"
+    "  3. Enable an existing domain\n"
+    "  4. Delete an existing domain\n"
+    "  5. Add HTTPS to a domain (Certbot - Manual Step)\n"
+    "  q. Quit\n"
+)
+
 def main_menu():
     while True:
         clear_screen() # Clear screen at the beginning of each loop iteration
-        print("\n--- Nginx Domain Management Script ---")
-        print("  1. List all configured domains")
-        print("  2. Add a new domain (Reverse Proxy)")
-        print("  3. Enable an existing domain")
-        print("  4. Delete an existing domain")
-        print("  5. Add HTTPS to a domain (Certbot - Manual Step)")
-        print("  q. Quit")
-        
+        sys.stdout.write(MAIN_MENU) # One write for the whole menu
+        sys.stdout.flush()
+
         choice = input("Enter your choice: ").strip().lower()
 
         if choice == '1':
@@ -416,20 +662,94 @@ def main_menu():
             sys.exit(0)
         else:
             print("Invalid choice. Please try again.")
-            input("\nPress Enter to continue...") # Pause for invalid choice
+            pause("\nPress Enter to continue...") # Pause for invalid choice
+
+# --- Command Line ---
+
+def parse_args(argv=None):
+    """Parses command line arguments. Without a subcommand the interactive menu is started."""
+    parser = argparse.ArgumentParser(
+        description="Manage Nginx reverse proxy domains. Run without a subcommand for the interactive menu.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    subparsers.add_parser('list', help="List all configured domains")
+
+    add_parser = subparsers.add_parser('add', help="Add a new domain (reverse proxy)")
+    add_parser.add_argument('domain', help="Domain name, e.g. ai.pikhof.eu")
+    add_parser.add_argument('upstream', help="Internal URL to proxy to, e.g. localhost:3210")
+    add_parser.add_argument('--overwrite', action='store_true', help="Overwrite an existing configuration")
+
+    enable_parser = subparsers.add_parser('enable', help="Enable an existing domain")
+    enable_parser.add_argument('domain')
+
+    delete_parser = subparsers.add_parser('delete', help="Delete a domain configuration")
+    delete_parser.add_argument('domain')
+    delete_parser.add_argument('-y', '--yes', action='store_true', help="Confirm the deletion")
+
+    https_parser = subparsers.add_parser('https', help="Print the Certbot command to add HTTPS to a domain")
+    https_parser.add_argument('domain')
+    https_parser.add_argument('--enable', action='store_true', help="Enable the domain first if it is disabled")
+
+    return parser.parse_args(argv)
+
+def run_command(args):
+    """Runs a single subcommand without prompts. Returns the process exit code."""
+    global INTERACTIVE
+    INTERACTIVE = False
+    if args.command == 'list':
+        return 0 if list_domains() is not None else 1
+    if args.command == 'add':
+        ok = add_new_domain(args.domain, args.upstream, overwrite=args.overwrite)
+    elif args.command == 'enable':
+        ok = enable_domain(args.domain)
+    elif args.command == 'delete':
+        ok = delete_domain(args.domain, assume_yes=args.yes)
+    else: # https
+        ok = add_https(args.domain, enable=args.enable)
+    return 0 if ok else 1
 
 if __name__ == "__main__":
-    try:
-        # Initial check for sudo privileges
-        # Changed stdout=subprocess.Stdout() to stdout=subprocess.DEVNULL
-        subprocess.run(['sudo', '-v'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        print("Sudo privileges seem to be available.")
-    except subprocess.CalledProcessError:
-        print("Error: This script requires sudo. Please configure your sudo permissions.")
-        sys.exit(1)
-    except FileNotFoundError:
-        print("Error: 'sudo' command not found. Is it installed and in your PATH?")
-        sys.exit(1)
+    if sys.argv[1:] == ['--helper']:
+        helper_serve() # Started by start_helper() under sudo
+        sys.exit(0)
+
+    args = parse_args()
+    if args.command is not None:
+        # Privileged helper is started on first use, so 'list' never needs sudo
+        sys.exit(run_command(args))
+
+    if IS_ROOT:
+        print("Running as root; sudo is not needed.")
+    else:
+        try:
+            # Initial check for sudo privileges
+            # 'sudo -n true' succeeds without prompting when the sudo timestamp is still valid;
+            # only fall back to the (prompting) 'sudo -v' when it is not
+            if subprocess.run(['sudo', '-n', 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+                subprocess.run(['sudo', '-v'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            print("Sudo privileges seem to be available.")
+        except subprocess.CalledProcessError:
+            print("Error: This script requires sudo. Please configure your sudo permissions.")
+            sys.exit(1)
+        except FileNotFoundError:
+            print("Error: 'sudo' command not found. Is it installed and in your PATH?")
+            sys.exit(1)
+
+    # Start the privileged helper in the background while the user reads the banner,
+    # so the first menu action does not wait for it. Credentials were validated above,
+    # so sudo runs with -n and never competes with input() for the terminal.
+    helper_status = {}
+    helper_thread = None
+    if not IS_ROOT:
+        helper_thread = threading.Thread(target=lambda: helper_status.update(ok=start_helper(non_interactive=True)), daemon=True)
+        helper_thread.start()
 
     input("\nPress Enter to start Nginx Management Script...") # Initial pause before clearing
+
+    if helper_thread is not None:
+        helper_thread.join()
+        # sudo -n fails if the credentials were not cached (e.g. timestamp_timeout=0);
+        # start it again, this time letting sudo prompt. helper_call() retries on first use otherwise.
+        if not helper_status.get('ok') and not start_helper():
+            print("Warning: Could not start the privileged helper process with sudo. It will be retried when needed.")
     main_menu()